@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import argparse
+import asyncio
+import json
+import os.path
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import blame_analysis_sh
+
+description = """Check (and time) AsyncBulkUploader against a local
+stand-in for the ElasticSearch bulk endpoint.
+
+    The stand-in answers POST /_bulk requests on persistent connections,
+    alternating content-length and chunked responses, with some latency.
+    Documents with ids starting with "bad" are answered with status 400,
+    and those starting with "busy" with status 429 the first time (so
+    that they are retried). Then, documents are uploaded while the
+    stand-in answers with a body which is not JSON (they should fail),
+    and with an uploader whose workers fail (the upload should raise
+    the error). Exits with status 1 if the upload state is not the
+    expected one, or if an upload doesn't finish in time.
+
+    """
+
+def parse_args ():
+
+    parser = argparse.ArgumentParser(description = description)
+    parser.add_argument("--docs", type=int, default=20000,
+                        help = "Number of documents to upload (default: 20000)")
+    parser.add_argument("--bad", type=int, default=10,
+                        help = "Number of documents answered with status 400 (default: 10)")
+    parser.add_argument("--busy", type=int, default=100,
+                        help = "Number of documents answered with status 429 the first time (default: 100)")
+    parser.add_argument("--connections", type=int, default=8,
+                        help = "Connections for the uploader (default: 8)")
+    parser.add_argument("--chunk_size", type=int, default=64,
+                        help = "Initial size of bulk requests, in KB (default: 64)")
+    parser.add_argument("--latency", type=float, default=10,
+                        help = "Latency of the stand-in per request, in ms (default: 10)")
+    parser.add_argument("--port", type=int, default=9299,
+                        help = "Port for the stand-in (default: 9299)")
+    parser.add_argument("--broken", type=int, default=1000,
+                        help = "Number of documents to upload with broken responses (default: 1000)")
+    parser.add_argument("--timeout", type=float, default=20,
+                        help = "Maximum time for uploads with broken responses, "
+                            "or failing workers, in seconds (default: 20)")
+    return parser.parse_args()
+
+class BulkEndpoint():
+    """Stand-in for the ElasticSearch bulk endpoint.
+
+    """
+
+    def __init__(self, port, latency):
+
+        self.port = port
+        self.latency = latency
+        self.requests = 0
+        self.connections = 0
+        self.docs = 0
+        self.rejected = set()
+        self.broken = False
+        self.ready = threading.Event()
+
+    async def handle(self, reader, writer):
+
+        self.connections += 1
+        while True:
+            line = await reader.readline()
+            if not line:
+                break
+            headers = {}
+            while True:
+                header = await reader.readline()
+                if header in (b'\r\n', b''):
+                    break
+                (name, value) = header.decode('utf-8').split(':', 1)
+                headers[name.lower()] = value.strip()
+            body = await reader.readexactly(int(headers['content-length']))
+            lines = body.decode('utf-8').strip().split('\n')
+            items = []
+            for meta in lines[0::2]:
+                id = json.loads(meta)['index']['_id']
+                if id.startswith('bad'):
+                    status = 400
+                elif id.startswith('busy') and (id not in self.rejected):
+                    self.rejected.add(id)
+                    status = 429
+                else:
+                    status = 201
+                items.append({'index': {'_id': id, 'status': status}})
+            self.requests += 1
+            self.docs += len(items)
+            await asyncio.sleep(self.latency)
+            response = json.dumps({'took': 1, 'errors': False,
+                                    'items': items}).encode('utf-8')
+            if self.broken:
+                response = b'oops'
+            if self.requests % 2 == 0:
+                writer.write(b'HTTP/1.1 200 OK\r\nTransfer-Encoding: chunked\r\n\r\n'
+                            + hex(len(response))[2:].encode('utf-8') + b'\r\n'
+                            + response + b'\r\n0\r\n\r\n')
+            else:
+                writer.write(b'HTTP/1.1 200 OK\r\nContent-Length: %d\r\n\r\n'
+                            % len(response) + response)
+            await writer.drain()
+        writer.close()
+
+    def run(self):
+
+        async def serve():
+            server = await asyncio.start_server(self.handle, 'localhost', self.port)
+            self.loop = asyncio.get_running_loop()
+            self.stopped = asyncio.Event()
+            self.ready.set()
+            async with server:
+                await self.stopped.wait()
+
+        asyncio.run(serve())
+
+    def stop(self):
+
+        self.loop.call_soon_threadsafe(self.stopped.set)
+
+class FailingUploader(blame_analysis_sh.AsyncBulkUploader):
+    """Uploader whose workers fail when recording results.
+
+    """
+
+    def _record(self, chunk, status, response, uploaded, retry=False):
+
+        raise RuntimeError("failing worker")
+
+def upload_in_time(uploader, actions, uploaded, timeout):
+    """Upload in a thread, waiting at most timeout seconds.
+
+    :returns: tuple with (items uploaded, items failed), or None if
+        the upload didn't finish, and the error raised (or None)
+
+    """
+
+    result = {'counts': None, 'error': None}
+
+    def upload():
+        try:
+            result['counts'] = uploader.upload(actions, uploaded)
+        except Exception as e:
+            result['error'] = e
+
+    thread = threading.Thread(target=upload, daemon=True)
+    thread.start()
+    thread.join(timeout)
+    if thread.is_alive():
+        return (None, None)
+    return (result['counts'], result['error'])
+
+def actions(docs, bad, busy):
+
+    for doc in range(docs):
+        if doc < bad:
+            id = 'bad' + str(doc)
+        elif doc < bad + busy:
+            id = 'busy' + str(doc)
+        else:
+            id = str(doc)
+        yield {'_index': 'blame', '_type': 'file_hash', '_id': id,
+                '_source': {'file': 'dir/file' + str(doc) + '.py',
+                            'author': 'Author ' + str(doc % 100),
+                            'lines': doc % 50}}
+
+if __name__ == "__main__":
+    args = parse_args()
+    endpoint = BulkEndpoint(port=args.port, latency=args.latency / 1000)
+    server = threading.Thread(target=endpoint.run)
+    server.start()
+    endpoint.ready.wait()
+
+    uploader = blame_analysis_sh.AsyncBulkUploader(
+        es_url='http://localhost:' + str(args.port),
+        connections=args.connections,
+        chunker=blame_analysis_sh.AdaptiveChunker(size=args.chunk_size * 2**10,
+                                                min_size=2**14))
+    uploaded = {}
+    start = time.time()
+    try:
+        (items_uploaded, items_failed) = uploader.upload(
+            actions(args.docs, args.bad, args.busy), uploaded)
+        elapsed = time.time() - start
+        requests = endpoint.requests
+        connections = endpoint.connections
+        endpoint.broken = True
+        broken_uploaded = {}
+        (broken_counts, broken_error) = upload_in_time(uploader,
+            actions(args.broken, 0, 0), broken_uploaded, args.timeout)
+        endpoint.broken = False
+        failing = FailingUploader(es_url='http://localhost:' + str(args.port),
+                                connections=args.connections)
+        (failing_counts, failing_error) = upload_in_time(failing,
+            actions(args.docs, 0, 0), {}, args.timeout)
+    finally:
+        endpoint.stop()
+        server.join()
+
+    print("Uploaded: ", items_uploaded, ", failed: ", items_failed,
+            ", requests: ", requests, ", connections: ", connections,
+            ", rejected (429) and retried: ", len(endpoint.rejected),
+            ", time: %.2f s (%.0f docs/s)" % (elapsed, args.docs / elapsed))
+    errors = []
+    if (items_uploaded != args.docs - args.bad) or (items_failed != args.bad):
+        errors.append("unexpected number of documents uploaded or failed")
+    if len(uploaded) != args.docs:
+        errors.append("upload state has " + str(len(uploaded)) + " documents")
+    if any(uploaded[id] != (not id.startswith('bad')) for id in uploaded):
+        errors.append("upload state is wrong for some documents")
+    if connections > args.connections:
+        errors.append("more connections than expected: " + str(connections))
+    print("Broken responses: ", broken_counts, ", error: ", broken_error)
+    if broken_error is not None:
+        errors.append("upload with broken responses raised: " + str(broken_error))
+    elif broken_counts is None:
+        errors.append("upload with broken responses didn't finish in time")
+    elif (broken_counts != (0, args.broken)) \
+        or any(broken_uploaded.values()) or (len(broken_uploaded) != args.broken):
+        errors.append("unexpected upload state with broken responses")
+    print("Failing workers: ", failing_counts, ", error: ", failing_error)
+    if (failing_counts is None) and (failing_error is None):
+        errors.append("upload with failing workers didn't finish in time")
+    elif failing_error is None:
+        errors.append("upload with failing workers didn't raise an error")
+    for error in errors:
+        print("ERROR:", error)
+    if len(errors) > 0:
+        sys.exit(1)
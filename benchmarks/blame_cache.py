@@ -0,0 +1,176 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import argparse
+import contextlib
+import io
+import os
+import os.path
+import shelve
+import subprocess
+import sys
+import tempfile
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import blame_analysis_sh
+
+description = """Check blaming with a blame cache against plain git blame.
+
+    A small repository is built, with files copied (in the same commit
+    that changes the original) so that copies have the same content and
+    last commit as the original, but a different history. It is then
+    blamed without cache, and twice with a cache (the second time, from
+    a clone, as a fork would be). Fails (exit status 1) if any file gets
+    a different blame with the cache, if the clone doesn't hit the cache,
+    or if the cache can be opened twice at the same time. Then, files are
+    blamed in move mode with a budget too small (so that they are blamed
+    in plain mode), and again with no budget: fails if the second run
+    doesn't blame them in move mode.
+
+    """
+
+def parse_args ():
+
+    parser = argparse.ArgumentParser(description = description)
+    parser.add_argument("--workdir", type=str,
+                        help = "Directory for repositories and files (default: temporary)")
+    return parser.parse_args()
+
+def git(repodir, args):
+
+    env = dict(os.environ, GIT_AUTHOR_NAME='Author', GIT_AUTHOR_EMAIL='author@example.com',
+                GIT_COMMITTER_NAME='Author', GIT_COMMITTER_EMAIL='author@example.com')
+    subprocess.run(['git'] + args, cwd=repodir, env=env, check=True,
+                    stdout=subprocess.DEVNULL)
+
+def write(repodir, name, lines):
+
+    path = os.path.join(repodir, name)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, 'w') as file:
+        file.write('\n'.join(lines) + '\n')
+
+def build_repo(repodir):
+    """Build the repository.
+
+    Commit 1 adds a.txt and dir/c.txt. Commit 2 changes the first line
+    of a.txt, and copies it to b.txt. Commit 3 changes dir/c.txt, and
+    copies it to dir/d.txt and e.txt.
+
+    """
+
+    git(repodir, ['init', '-q'])
+    write(repodir, 'a.txt', ['one', 'two', 'three'])
+    write(repodir, 'dir/c.txt', ['four', 'five', 'six'])
+    git(repodir, ['add', '-A'])
+    git(repodir, ['commit', '-q', '-m', 'commit 1'])
+    write(repodir, 'a.txt', ['one changed', 'two', 'three'])
+    write(repodir, 'b.txt', ['one changed', 'two', 'three'])
+    git(repodir, ['add', '-A'])
+    git(repodir, ['commit', '-q', '-m', 'commit 2'])
+    for name in ['dir/c.txt', 'dir/d.txt', 'e.txt']:
+        write(repodir, name, ['four', 'five changed', 'six'])
+    git(repodir, ['add', '-A'])
+    git(repodir, ['commit', '-q', '-m', 'commit 3'])
+
+def blame(repodir, storename, cache=None, mode='plain', budget=None):
+    """Blame all files in repodir, with cache (if not None).
+
+    :returns: dictionary, for each file, with the sorted list of
+        (summary, lines, filename, file_blamed, blame_mode) for its snippets
+
+    """
+
+    store = shelve.open(storename)
+    with contextlib.redirect_stdout(io.StringIO()):
+        blame_analysis_sh.blame_files(repouri=repodir, repodir=repodir,
+                                    store=store, cache=cache, mode=mode,
+                                    budget=budget)
+    result = {file: sorted([(snippet['data']['summary'], snippet['data']['lines'],
+                            snippet['data']['filename'], snippet['data']['file_blamed'],
+                            snippet['data']['blame_mode'])
+                            for snippet in store[file]])
+                for file in store}
+    store.close()
+    return result
+
+def modes(result):
+    """Blame modes used in result (as returned by blame).
+
+    """
+
+    return set([snippet[4] for file in result for snippet in result[file]])
+
+def compare(expected, result, name, errors):
+
+    for file in sorted(expected):
+        if result.get(file) != expected[file]:
+            errors.append(name + ": " + file + " blamed as " + str(result.get(file))
+                            + ", expected " + str(expected[file]))
+
+if __name__ == "__main__":
+    args = parse_args()
+    errors = []
+    with tempfile.TemporaryDirectory() as tmpdir:
+        workdir = args.workdir or tmpdir
+        repodir = os.path.join(workdir, 'repo')
+        os.makedirs(repodir, exist_ok=True)
+        build_repo(repodir)
+        forkdir = os.path.join(workdir, 'fork')
+        subprocess.run(['git', 'clone', '-q', repodir, forkdir], check=True)
+        cachename = os.path.join(workdir, 'cache')
+
+        expected = blame(repodir, os.path.join(workdir, 'store-plain'))
+        cache = blame_analysis_sh.BlameCache(cachename, max_size=2**20)
+        try:
+            try:
+                blame_analysis_sh.BlameCache(cachename, max_size=2**20)
+                errors.append("cache opened twice at the same time")
+            except RuntimeError:
+                pass
+            compare(expected, blame(repodir, os.path.join(workdir, 'store-cache'),
+                                    cache=cache),
+                    'cache (empty)', errors)
+            hits = cache.hits
+            compare(expected, blame(forkdir, os.path.join(workdir, 'store-fork'),
+                                    cache=cache),
+                    'cache (fork)', errors)
+            print("Files: ", len(expected), ", entries in cache: ", len(cache.lru),
+                    ", hits for the fork: ", cache.hits - hits)
+            if cache.hits - hits != len(expected):
+                errors.append("fork hit the cache for " + str(cache.hits - hits)
+                                + " files, expected " + str(len(expected)))
+            over = blame(repodir, os.path.join(workdir, 'store-over'),
+                        cache=cache, mode='move', budget=1e-6)
+            retried = blame(repodir, os.path.join(workdir, 'store-retried'),
+                            cache=cache, mode='move')
+            print("Modes with a budget too small: ", sorted(modes(over)),
+                    ", with no budget: ", sorted(modes(retried)))
+            if modes(over) != {'plain'}:
+                errors.append("files over budget blamed in modes " + str(modes(over)))
+            if modes(retried) != {'move'}:
+                errors.append("files blamed in modes " + str(modes(retried))
+                                + " after a run over budget, expected move")
+        finally:
+            cache.close()
+    for error in errors:
+        print("ERROR:", error)
+    if len(errors) > 0:
+        sys.exit(1)
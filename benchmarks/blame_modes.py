@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import argparse
+import contextlib
+import io
+import os
+import os.path
+import random
+import shelve
+import subprocess
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+import blame_analysis_sh
+
+description = """Benchmark blame modes on a synthetic repository.
+
+    The repository is built with commits adding blocks of lines to files,
+    and commits moving blocks from one file to another (or within a
+    file). Each line records the commit which introduced it, so that
+    attribution can be checked: for each mode, the time to blame all
+    files, its overhead over plain mode, the files over budget, and the
+    percentage of lines attributed to the commit introducing them are
+    printed.
+
+    """
+
+def parse_args ():
+
+    parser = argparse.ArgumentParser(description = description)
+    parser.add_argument("--files", type=int, default=40,
+                        help = "Number of files (default: 40)")
+    parser.add_argument("--commits", type=int, default=200,
+                        help = "Number of commits (default: 200)")
+    parser.add_argument("--moves", type=float, default=0.3,
+                        help = "Fraction of commits moving a block (default: 0.3)")
+    parser.add_argument("--budget", type=float,
+                        help = "Time budget per file, in seconds (default: no budget)")
+    parser.add_argument("--seed", type=int, default=0,
+                        help = "Seed for the random generator (default: 0)")
+    parser.add_argument("--repodir", type=str,
+                        help = "Directory for the synthetic repository (default: temporary)")
+    return parser.parse_args()
+
+def git(repodir, args):
+
+    env = dict(os.environ, GIT_AUTHOR_NAME='Author', GIT_AUTHOR_EMAIL='author@example.com',
+                GIT_COMMITTER_NAME='Author', GIT_COMMITTER_EMAIL='author@example.com')
+    subprocess.run(['git'] + args, cwd=repodir, env=env, check=True,
+                    stdout=subprocess.DEVNULL)
+
+def build_repo(repodir, files, commits, moves, rand):
+    """Build a synthetic repository.
+
+    Files are lists of blocks, each block a list of lines. Lines are
+    "commit <n> block <b> line <l>", n being the commit introducing them.
+    Commit messages are "commit <n>".
+
+    :returns: number of lines in HEAD
+
+    """
+
+    git(repodir, ['init', '-q'])
+    names = ['dir' + str(file % 5) + '/file' + str(file) + '.py'
+                for file in range(files)]
+    contents = {name: [] for name in names}
+    nblock = 0
+    for commit in range(commits):
+        name = rand.choice(names)
+        if (commit >= files) and (rand.random() < moves):
+            # Move a block, from a file to another (or the same) file
+            source = rand.choice([name for name in names if len(contents[name]) > 0])
+            block = contents[source].pop(rand.randrange(len(contents[source])))
+            contents[name].insert(rand.randint(0, len(contents[name])), block)
+            changed = [source, name]
+        else:
+            block = ['commit %d block %d line %d' % (commit, nblock, line)
+                        for line in range(rand.randint(5, 30))]
+            nblock += 1
+            if commit < files:
+                # First commits create all files
+                name = names[commit]
+            contents[name].insert(rand.randint(0, len(contents[name])), block)
+            changed = [name]
+        for name in changed:
+            path = os.path.join(repodir, name)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'w') as file:
+                for block in contents[name]:
+                    file.write('\n'.join(block) + '\n')
+        git(repodir, ['add', '-A'])
+        git(repodir, ['commit', '-q', '--allow-empty', '-m', 'commit %d' % commit])
+    return sum([len(block) for name in names for block in contents[name]])
+
+def blame_mode(repodir, workdir, mode, budget):
+    """Blame all files in mode.
+
+    :returns: (seconds, files over budget, lines, lines attributed to
+        the commit introducing them)
+
+    """
+
+    store = shelve.open(os.path.join(workdir, 'store-' + mode))
+    start = time.time()
+    with contextlib.redirect_stdout(io.StringIO()):
+        blame_analysis_sh.blame_files(repouri=repodir, repodir=repodir,
+                                    store=store, mode=mode, budget=budget)
+    elapsed = time.time() - start
+    # Lines per commit, as blamed and as introduced
+    blamed = {}
+    fallbacks = 0
+    for file in store:
+        if any(snippet['data']['blame_mode'] != mode for snippet in store[file]):
+            fallbacks += 1
+        for snippet in store[file]:
+            summary = snippet['data']['summary']
+            blamed[summary] = blamed.get(summary, 0) + int(snippet['data']['lines'])
+    store.close()
+    introduced = {}
+    for name in subprocess.run(['git', 'ls-files'], cwd=repodir, check=True,
+                                stdout=subprocess.PIPE,
+                                universal_newlines=True).stdout.split():
+        with open(os.path.join(repodir, name)) as file:
+            for line in file:
+                summary = ' '.join(line.split()[:2])
+                introduced[summary] = introduced.get(summary, 0) + 1
+    lines = sum(introduced.values())
+    right = sum([min(introduced[summary], blamed.get(summary, 0))
+                    for summary in introduced])
+    return (elapsed, fallbacks, lines, right)
+
+if __name__ == "__main__":
+    args = parse_args()
+    rand = random.Random(args.seed)
+    with tempfile.TemporaryDirectory() as workdir:
+        repodir = args.repodir or os.path.join(workdir, 'repo')
+        os.makedirs(repodir, exist_ok=True)
+        start = time.time()
+        lines = build_repo(repodir, args.files, args.commits, args.moves, rand)
+        print("Synthetic repository: files: %d, commits: %d, lines: %d (%.1f s to build)"
+                % (args.files, args.commits, lines, time.time() - start))
+        plain_time = None
+        for mode in ['plain', 'move', 'copy']:
+            (elapsed, fallbacks, lines, right) = blame_mode(repodir, workdir,
+                                                            mode, args.budget)
+            if plain_time is None:
+                plain_time = elapsed
+            print("%s: %.2f s (x%.2f plain), over budget: %d, right attribution: %.1f%%"
+                    % (mode, elapsed, elapsed / plain_time, fallbacks,
+                        100 * right / lines))
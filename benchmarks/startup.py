@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+
+import argparse
+import json
+import os.path
+import statistics
+import subprocess
+import sys
+import tempfile
+
+description = """Check startup time, and modules imported, for short runs.
+
+    Each run (process only, or query, on empty data) is done in a new
+    interpreter, several times. Fails (exit status 1) if a run imports
+    any of the heavy modules (not needed for it), or if its median time
+    (importing the script, and running it) is over the threshold.
+
+    """
+
+heavy_modules = ['elasticsearch', 'urllib3', 'perceval', 'sortinghat',
+                'asyncio', 'ssl']
+
+# Script, and arguments, for each run
+runs = {
+    'sh process_only': ['blame_analysis_sh.py', '--store', 'store',
+                        '--processed', 'processed', '--assume_store',
+                        '--process_only'],
+    'sh query': ['blame_analysis_sh.py', '--processed', 'processed',
+                '--query', 'ext'],
+    'process_only': ['blame_analysis.py', '--store', 'store',
+                    '--processed', 'processed', '--assume_store',
+                    '--process_only', 'repo']
+}
+
+# Run in the new interpreter: time and modules for a run of a script
+runner = """
+import os, sys, time, runpy, json
+start = time.perf_counter()
+sys.argv = sys.argv[1:]
+# As when running the script: its directory is the first in sys.path
+sys.path.insert(0, os.path.dirname(os.path.abspath(sys.argv[0])))
+try:
+    runpy.run_path(sys.argv[0], run_name='__main__')
+except SystemExit:
+    pass
+elapsed = time.perf_counter() - start
+print(json.dumps({'time': elapsed, 'modules': list(sys.modules.keys())}))
+"""
+
+def parse_args ():
+
+    parser = argparse.ArgumentParser(description = description)
+    parser.add_argument("--runs", type=int, default=5,
+                        help = "Times each run is done (default: 5)")
+    parser.add_argument("--max_time", type=float, default=0.3,
+                        help = "Maximum median time for a run, in seconds (default: 0.3)")
+    return parser.parse_args()
+
+def run(script, args, dir):
+    """Run script with args in a new interpreter, in dir.
+
+    :returns: (time, modules) for the run
+
+    """
+
+    output = subprocess.run([sys.executable, '-c', runner, script] + args,
+                            cwd=dir, check=True, stdout=subprocess.PIPE,
+                            universal_newlines=True).stdout
+    result = json.loads(output.strip().split('\n')[-1])
+    return (result['time'], result['modules'])
+
+if __name__ == "__main__":
+    args = parse_args()
+    scripts_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+    errors = []
+    with tempfile.TemporaryDirectory() as dir:
+        for name in runs:
+            script = os.path.join(scripts_dir, runs[name][0])
+            times = []
+            for i in range(args.runs):
+                (time, modules) = run(script, runs[name][1:], dir)
+                times.append(time)
+            imported = [module for module in heavy_modules
+                        if any((loaded == module) or loaded.startswith(module + '.')
+                                for loaded in modules)]
+            median = statistics.median(times)
+            print("%s: %.1f ms (median of %d), heavy modules imported: %s"
+                    % (name, median * 1000, args.runs, imported))
+            if len(imported) > 0:
+                errors.append(name + ": imports " + ', '.join(imported))
+            if median > args.max_time:
+                errors.append(name + ": %.1f ms, over %.1f ms"
+                                % (median * 1000, args.max_time * 1000))
+    for error in errors:
+        print("ERROR:", error)
+    if len(errors) > 0:
+        sys.exit(1)
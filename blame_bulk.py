@@ -0,0 +1,193 @@
+# -*- coding: utf-8 -*-
+#
+# Copyright (C) 2015-2016 Bitergia
+#
+# This program is free software; you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation; either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 59 Temple Place - Suite 330, Boston, MA 02111-1307, USA.
+#
+# Authors:
+#     Jesus M. Gonzalez-Barahona <jgb@bitergia.com>
+#
+
+"""Bulk requests to ElasticSearch, sized adaptively.
+
+Shared by blame_analysis.py and blame_analysis_sh.py.
+
+"""
+
+import json
+import logging
+import threading
+import time
+
+class AdaptiveChunker():
+    """Group bulk actions in chunks sized by bytes, adapting the size to
+    the latency of bulk requests and to rejections.
+
+    After each bulk request, the target size of chunks is halved if
+    some action was rejected (status 429, ElasticSearch queues are
+    full), reduced in proportion if latency was over target_latency, and
+    increased by 20% if latency was under it, and the chunk was full
+    (retries of rejected actions, larger than the new target, are not).
+    Each decision is written as a JSON line to metrics (if not None).
+    The chunker can be shared by several threads.
+
+    :param target_latency: target latency for bulk requests (seconds)
+    :param size:           initial size of chunks (bytes)
+    :param min_size:       minimum size of chunks (bytes)
+    :param max_size:       maximum size of chunks (bytes)
+    :param metrics:        file to write decisions (None for no metrics)
+
+    """
+
+    def __init__(self, target_latency=1.0, size=5 * 2**20, min_size=2**18,
+                max_size=50 * 2**20, metrics=None):
+
+        self.target_latency = target_latency
+        self.size = size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.metrics = metrics
+        self.lock = threading.Lock()
+
+    def action_lines(self, action):
+        """Lines (JSON) for an action in a bulk request.
+
+        Actions are indexed, unless their _op_type is 'delete'. Since
+        JSON is produced with ensure_ascii, length in characters is
+        also length in bytes.
+
+        """
+
+        op_type = action.get('_op_type', 'index')
+        meta = {op_type: {'_index': action['_index'],
+                        '_type': action['_type'],
+                        '_id': action['_id']}}
+        if op_type == 'delete':
+            return json.dumps(meta) + '\n'
+        return json.dumps(meta) + '\n' + json.dumps(action['_source']) + '\n'
+
+    def chunks(self, actions):
+        """Group actions in chunks, of the current target size.
+
+        :param actions: generator of actions
+        :returns:       generator of tuples (actions, lines), lines being
+            the list of lines for each action (see action_lines)
+
+        """
+
+        chunk = []
+        lines = []
+        size = 0
+        for action in actions:
+            action_lines = self.action_lines(action)
+            if (len(chunk) > 0) and (size + len(action_lines) > self.size):
+                yield (chunk, lines)
+                chunk = []
+                lines = []
+                size = 0
+            chunk.append(action)
+            lines.append(action_lines)
+            size += len(action_lines)
+        if len(chunk) > 0:
+            yield (chunk, lines)
+
+    def record(self, nbytes, ndocs, latency, rejected):
+        """Record the result of a bulk request, adapting the target size.
+
+        :param nbytes:   size of the request (bytes)
+        :param ndocs:    number of actions in the request
+        :param latency:  latency of the request (seconds)
+        :param rejected: number of actions rejected
+
+        """
+
+        with self.lock:
+            previous = self.size
+            if rejected > 0:
+                decision = 'rejected'
+                self.size = self.size // 2
+            elif latency > self.target_latency:
+                decision = 'slow'
+                self.size = int(self.size * max(0.5, self.target_latency / latency))
+            elif 0.9 * self.size <= nbytes <= self.size:
+                decision = 'grow'
+                self.size = int(self.size * 1.2)
+            else:
+                decision = 'keep'
+            self.size = min(self.max_size, max(self.min_size, self.size))
+            logging.debug("AdaptiveChunker: %s (%d docs, %d bytes, %.3f s, %d rejected), size: %d -> %d.",
+                        decision, ndocs, nbytes, latency, rejected, previous, self.size)
+            if self.metrics is not None:
+                self.metrics.write(json.dumps({
+                    'metric': 'bulk_chunk',
+                    'time': time.time(),
+                    'docs': ndocs,
+                    'bytes': nbytes,
+                    'latency': latency,
+                    'rejected': rejected,
+                    'decision': decision,
+                    'size': previous,
+                    'next_size': self.size
+                    }) + '\n')
+                self.metrics.flush()
+
+def adaptive_bulk(es, actions, chunker, max_retries=3):
+    """Upload actions with bulk requests, with chunks sized by chunker.
+
+    Actions rejected by ElasticSearch (status 429) are retried, after
+    some backoff, up to max_retries times.
+
+    :param es:          ElasticSearch client
+    :param actions:     generator of actions
+    :param chunker:     AdaptiveChunker object
+    :param max_retries: maximum number of retries for rejected actions
+    :returns:           generator of tuples (ok, item), as
+        elasticsearch.helpers.streaming_bulk with raise_on_error=False
+
+    """
+
+    import elasticsearch
+
+    for (chunk, lines) in chunker.chunks(actions):
+        attempt = 0
+        while len(chunk) > 0:
+            body = ''.join(lines)
+            start = time.time()
+            try:
+                items = es.bulk(body=body)['items']
+            except elasticsearch.exceptions.TransportError as e:
+                if e.status_code != 429:
+                    raise
+                # The whole request was rejected
+                items = [{action.get('_op_type', 'index'):
+                            {'_id': action['_id'], 'status': 429}}
+                            for action in chunk]
+            latency = time.time() - start
+            retry = []
+            retry_lines = []
+            for (action, action_lines, item) in zip(chunk, lines, items):
+                status = list(item.values())[0].get('status', 500)
+                if (status == 429) and (attempt < max_retries):
+                    retry.append(action)
+                    retry_lines.append(action_lines)
+                else:
+                    yield (200 <= status < 300, item)
+            chunker.record(nbytes=len(body), ndocs=len(chunk),
+                            latency=latency, rejected=len(retry))
+            if len(retry) > 0:
+                attempt += 1
+                time.sleep(0.5 * 2**attempt)
+            chunk = retry
+            lines = retry_lines